@@ -0,0 +1,61 @@
+"""checkimports
+Checks that prr, sevenpy and find7Pcompression import quickly and without
+matplotlib, pylab or wx, which are only to be imported when something is
+plotted or shown.  Each module is imported in a fresh interpreter so earlier
+imports do not hide the cost.
+
+python checkimports.py [seconds]
+
+The optional argument is the longest an import may take, 0.5 s by default.
+Exits with 1 if any module fails.
+"""
+
+import os, sys, subprocess
+
+modules = ['prr', 'sevenpy', 'find7Pcompression']
+heavy = ['matplotlib', 'pylab', 'wx']
+
+# run in the fresh interpreter; prints the import time and any heavy modules
+probe = """
+import sys, time
+start = time.time()
+import %s
+print time.time() - start, ' '.join([name for name in %r if name in sys.modules])
+"""
+
+def checkimport(module, limit):
+    """Imports module in a new interpreter and returns a list of what is
+    wrong with the import, which is empty if nothing is."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, '-c', probe % (module, heavy)],
+        cwd = here, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        return ['import failed: ' + err.strip().split('\n')[-1]]
+    # the last line is from the probe, anything before from the module
+    fields = out.strip().split('\n')[-1].split(None, 1)
+    problems = []
+    seconds = float(fields[0])
+    print module + ' imported in %.3f s' % seconds
+    if seconds > limit:
+        problems.append('took %.3f s, more than %.3f s' % (seconds, limit))
+    if len(fields) > 1:
+        problems.append('imported ' + fields[1])
+    return problems
+
+def main():
+    if len(sys.argv) > 1:
+        limit = float(sys.argv[1])
+    else:
+        limit = 0.5
+    failed = False
+    for module in modules:
+        for problem in checkimport(module, limit):
+            print module + ' ' + problem
+            failed = True
+    if failed:
+        sys.exit(1)
+    print 'all imports ok'
+
+if __name__ == '__main__':
+    main()
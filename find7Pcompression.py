@@ -7,27 +7,37 @@ UNH thesis by Sam Greenaway and provides a table of the 1dB compression points
 as well as the offsets between different gain curves.
 """
 
-import pylab as pl
 import time, sys
-import wx
-
-#junk for the lasso stuff
-from matplotlib.widgets import Lasso
-import matplotlib.mlab
-#from matplotlib.nxutils import points_inside_poly
-from matplotlib.path import Path as mpl_path
-from matplotlib.colors import colorConverter
-from matplotlib.collections import RegularPolyCollection
-from matplotlib.collections import LineCollection
 
 import copy
 
 import prr
 
+# pylab and the lasso classes are only imported by pylab() when an fsp or
+# LassoManager is made
+pl = None
+Lasso = mpl_path = RegularPolyCollection = LineCollection = None
+
+def pylab():
+    """Imports pylab and the matplotlib classes used for the lasso the first
+    time it is called and returns pylab."""
+    global pl, Lasso, mpl_path, RegularPolyCollection, LineCollection
+    if pl is None:
+        import pylab as pl
+        from matplotlib.widgets import Lasso
+        #from matplotlib.nxutils import points_inside_poly
+        from matplotlib.path import Path as mpl_path
+        from matplotlib.collections import RegularPolyCollection
+        from matplotlib.collections import LineCollection
+    return pl
+
 class fsp:
-    def __init__(self, infilename = 'calfile.s7k'):
+    def __init__(self, infilename = 'calfile.s7k', processes = 1):
+        """Maps the calibration file, with a pool of processes if processes
+        is more than one (None for every core)."""
+        pylab()
         self.calfile = prr.x7kRead(infilename)
-        self.calfile.mapfile()
+        self.calfile.mapfile(processes = processes)
         self.settings = {}
         self.settings['power'] = []
         self.settings['gain'] = []
@@ -451,6 +461,7 @@ class fsp:
         
 class LassoManager:
     def __init__(self, ax, x, y):
+        pylab()
         self.axes = ax
         self.canvas = ax.figure.canvas
         self.y = y.T
@@ -19,6 +19,7 @@ import time
 from datetime import datetime
 import os, sys
 import threading
+import struct, Queue
 from scipy.interpolate import interp1d
 
 import prr
@@ -1033,33 +1034,58 @@ class Dataflowmanager:
         self.reson.stopUDP = False
         self.getnoise = False
         self.noise = None
+        self.noisethread = None
+        self.next7006 = None
+        # the records arrive on the TCP connection and are queued by type
+        self.reson.startreceiver((7000, 7006))
+        # 7018 records are only read now and then, so only the newest is kept
+        self.reson.receiver.subscribe((7018,), 1, latest = True)
         self.dataport = self.reson.command7P('selfrecordrequest',(2, 7000, 7006))
         self.type = '7kcenter'
         
     def start7kdata(self):
         """Pulls data from the sevenpy buffer and extracts the information needed."""
-        print "Beginning data extraction from UDP connection. ",
+        print "Beginning data extraction from TCP connection. ",
         while self.go:
-            if self.reson.newdata:
-                # pull data from the data stream buffer
-                data = self.reson.dataout
-                self.reson.newdata = False
-                if data.has_key('7000') and data.has_key('7006'):
-                    # check to make sure the time stamps of the packets are the same
-                    if data['7000'][20:30] == data['7006'][20:30]:
-                        subpacket7000 = prr.Data7000(data['7000'][64:-4])
-                        subpacket7006 = prr.Data7006(data['7006'][64:-4])
-                        intensity = subpacket7006.data[2]
-                        tempindx = np.nonzero(intensity == 0)
-                        intensity[tempindx] = np.nan
-                        self.gains = resontvg.getsumgain(subpacket7006.data[0],\
-                            subpacket7000.header[15], subpacket7000.header[-4],\
-                            subpacket7000.header[-2])
-                        self.intensity = 20*np.log10(intensity)
-                        self.frequency = subpacket7000.header[3]
-                    # else: print 'unmatching time stampes found!'
-            if self.getnoise:
-                threading.Thread(target = self.cycle7018).start()
+            if self.getnoise and (self.noisethread is None or not self.noisethread.isAlive()):
+                self.noisethread = threading.Thread(target = self.cycle7018)
+                self.noisethread.start()
+            try:
+                record7000 = self.reson.receiver.get(7000, 0.5)
+            except Queue.Empty:
+                continue
+            record7006 = self.match7006(record7000)
+            if record7006 is not None:
+                # buffers let the decoders read the records without a copy
+                subpacket7000 = prr.Data7000(buffer(record7000, 64, len(record7000) - 68))
+                subpacket7006 = prr.Data7006(buffer(record7006, 64, len(record7006) - 68))
+                intensity = subpacket7006.data[2]
+                tempindx = np.nonzero(intensity == 0)
+                intensity[tempindx] = np.nan
+                self.gains = resontvg.getsumgain(subpacket7006.data[0],\
+                    subpacket7000.header[15], subpacket7000.header[-4],\
+                    subpacket7000.header[-2])
+                self.intensity = 20*np.log10(intensity)
+                self.frequency = subpacket7000.header[3]
+            # else: print 'unmatching time stampes found!'
+            
+    def match7006(self, record7000):
+        """Returns the 7006 record with the same time stamp as the 7000
+        record, or None if there is none.  Older 7006 records are dropped and
+        a newer one is kept for the next 7000."""
+        pingtime = prr.headertime(*struct.unpack('<2Hf2B', record7000[20:30]))
+        while True:
+            if self.next7006 is None:
+                try:
+                    self.next7006 = self.reson.receiver.get(7006, 0.5)
+                except Queue.Empty:
+                    return None
+            rectime = prr.headertime(*struct.unpack('<2Hf2B', self.next7006[20:30]))
+            if rectime > pingtime:
+                return None
+            record7006, self.next7006 = self.next7006, None
+            if rectime == pingtime:
+                return record7006
 
         
     def stop7kcenter(self):
@@ -1104,6 +1130,8 @@ class Dataflowmanager:
         """
         Opens a port and requests a 7018 record.
         """
+        # drop any record left from the last request
+        self.last7018()
         self.tempdataport = self.reson.command7P('selfrecordrequest',(1, 7018)) 
         
     def proc7018(self):
@@ -1113,15 +1141,19 @@ class Dataflowmanager:
         floor given the current operating conditions.
         """
         # wait for a new record
-        timer = 0
-        while not self.reson.new7018 and timer < 1:
-            time.sleep(0.1)
-            timer += 0.1
+        try:
+            record = self.reson.receiver.get(7018, 1)
+        except Queue.Empty:
+            record = None
         # stop the record request
         self.stop7018()
-        if self.reson.new7018:
+        # use the newest record if more came before the request stopped
+        newer = self.last7018()
+        if newer is not None:
+            record = newer
+        if record is not None:
             # get the data
-            subpack = prr.Data7018(self.reson7018.data7018[64:-4])
+            subpack = prr.Data7018(buffer(record, 64, len(record) - 68))
             # average all the beams
             wc_avg = subpack.mag.mean(axis = 1)
             # find the first return and move back ten samples
@@ -1129,8 +1161,18 @@ class Dataflowmanager:
             # still need to remove gain and tvg here!!!
             print '!',
             self.noise = subpack.mag[:maxsample,:].mean()
-            # make sure that we are ready for new data
-            self.reson7018.new7018 = False
+        
+    def last7018(self):
+        """
+        Empties the 7018 queue and returns the newest record in it, or None
+        if it was empty.
+        """
+        record = None
+        while True:
+            try:
+                record = self.reson.receiver.queues[7018].get_nowait()
+            except Queue.Empty:
+                return record
         
     def stop7018(self):
         """
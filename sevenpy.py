@@ -11,10 +11,10 @@ command7P method is the primary way to assemble packets (commands) and send
 them. Thanks goes to Tom Weber
 """
 
-import socket, struct, time
-import pylab as pl
+import socket, struct, time, math, sys, os
 from datetime import datetime
 import threading
+import select, Queue
 
 class com7P:
     """Communications with the Reson 7P, both packets and sockets"""
@@ -38,6 +38,9 @@ class com7P:
         # Dictionary for counting packet numbers
         self.gain = {'level': 0, 'count': 0}
 
+        # Receiver started by startreceiver
+        self.receiver = None
+
         # Packet Formats
         self.nf_fmt = '<2HI2H4I2HI' #36 bytes
         self.drf_fmt = '<2H4I2Hf2BH4I2H3I'  #64 bytes
@@ -244,69 +247,80 @@ class com7P:
         self.UDPSock.close()
         return UDPPort
             
-    def catchUDP(self, port, filename = ''):
+    def catchUDP(self, port, filename = '', maxsize = 0, maxtime = 0):
         """Opens a recieving UDP connection with the 7P on the specified port
-        and logs the traffic to the specified filename."""
+        and logs the traffic to the specified filename.  The records are
+        written by a capturewriter, which starts a new file after maxsize
+        bytes or maxtime seconds if these are given, and are also made
+        available as they arrive as without a file."""
         self.outUDPSock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
         self.outUDPSock.settimeout(1)
+        # room in the socket for bursts while this thread is busy
+        self.outUDPSock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8388608)
         self.outUDPSock.bind((self.ownip, port))
         if len(filename) > 0:
-            self.outfile = open(filename,'wb')
+            self.writer = capturewriter(filename, maxsize, maxtime)
             print 'Writing to filename ' + filename
             tofile = True
         else:
             tofile = False
             print "Catching data on port " + str(port)
-            datain = {}
-            self.newdata = False
-            self.new7018 = False
-            self.new7038 = False
+        datain = {}
+        self.newdata = False
+        self.new7018 = False
+        self.new7038 = False
+        # records larger than a datagram come in several network frames
+        self.reassembler = reassembler7P()
+        pool = bufferpool()
         while not self.stopUDP:
+            self.reassembler.expire()
             try:
-                packet,addr = self.outUDPSock.recvfrom(self.buf)
-                if tofile:
-                    #self.outfile.write(packet[36:])
-                    self.tracksettings(packet)
-                else:
-                    packetsize = len(packet)
-                    if packetsize > 48:
-                        headersize = struct.unpack('I', packet[12:16])[0]
-                        datasize = struct.unpack('I', packet[44:48])[0] + 36
-                        if datasize == headersize and datasize == packetsize:
-                            type = struct.unpack('I', packet[68:72])[0]
-                            if type == 7000:
-                                self.dataout = datain
-                                self.newdata = True
-                                datain = {}
-                            elif type == 7018:
-                                print "yup"
-                                self.data7018 = packet[36:]
-                                self.new7018 = True
-                            elif type == 7038:
-                                self.data7038 = packet[36:]
-                                self.new7038 = True
-                            else:
-                                datain[str(type)] = packet[36:]
+                packet = pool.get()
+                count,addr = self.outUDPSock.recvfrom_into(packet)
+                for header, data in splitframes(packet, count):
+                    if header[2] > 1:
+                        data = str(data)  # kept until the transmission is complete
+                    data = self.reassembler.add(header, data, addr)
+                    if data is None:
+                        continue
+                    for record in splitrecords(data):
+                        if tofile:
+                            self.writer.write(record)
+                            self.tracksettings(record)
+                        type = struct.unpack_from('<I', record, 32)[0]
+                        if type == 7000:
+                            self.dataout = datain
+                            self.newdata = True
+                            datain = {}
+                        elif type == 7018:
+                            print "yup"
+                            self.data7018 = record
+                            self.new7018 = True
+                        elif type == 7038:
+                            self.data7038 = record
+                            self.new7038 = True
+                        else:
+                            datain[str(type)] = record
             except socket.timeout:
                 continue
         if tofile:
-            self.outfile.close()
+            self.writer.close()
                 
     def closeUDP(self):
         """Close the receiving UDP socket."""
         self.outUDPSock.close()
         
     def tracksettings(self, data):
-        """Increments the object mesg type counter based on provided data"""
-        mesg, = struct.unpack('I',data[68:72])
+        """Increments the object mesg type counter based on provided record"""
+        mesg, = struct.unpack_from('<I', data, 32)
         if mesg == 7000:
-            gain, = struct.unpack('f',data[162:166])
+            gain, = struct.unpack_from('<f', data, 126)
             if self.gain['level'] == gain:
                 self.gain['count'] += 1
                 n = str(self.gain['count'])
                 numb = len(n)+1
                 if self.gain['count']>1 and self.gain['count'] % 10 == 0:
-                    numb = int(pl.log10(self.gain['count'])) + 1
+                    numb = int(math.log10(self.gain['count'])) + 1
                 print numb * '\b' + n,
             else:
                 self.gain['level'] = gain
@@ -349,32 +363,25 @@ class com7P:
         self.newdata = False
         self.new7018 = False
         self.new7038 = False
+        framer = framer7P()
         while not self.stopTCP:
-            packet = reson_socket.recv(self.buf)
-            packetsize = len(packet)
-            if packetsize > 48:
-                headersize = struct.unpack('I', packet[12:16])[0]
-                datasize = struct.unpack('I', packet[44:48])[0] + 36
-                if datasize == headersize and datasize == packetsize:
-                    type = struct.unpack('I', packet[68:72])[0]
-                    if type == 7000:
-                        self.dataout = datain
-                        self.newdata = True
-                        datain = {}
-                        datain[str(type)] = packet[36:]
-                    elif type == 7018:
-                        self.data7018 = packet[36:]
-                        self.new7018 = True
-                    elif type == 7038:
-                        self.data7038 = packet[36:]
-                        self.new7038 = True
-                    else:
-                        datain[str(type)] = packet[36:]
-                # else:
-                    # print "size mismatch:"
-                    # print headersize,
-                    # print datasize,
-                    # print packetsize
+            if framer.recv(reson_socket) == 0:
+                break
+            for record in framer.records():
+                type = struct.unpack_from('<I', record, 32)[0]
+                if type == 7000:
+                    self.dataout = datain
+                    self.newdata = True
+                    datain = {}
+                    datain[str(type)] = record.tobytes()
+                elif type == 7018:
+                    self.data7018 = record.tobytes()
+                    self.new7018 = True
+                elif type == 7038:
+                    self.data7038 = record.tobytes()
+                    self.new7038 = True
+                else:
+                    datain[str(type)] = record.tobytes()
         reson_socket.shutdown(socket.SHUT_RDWR)
         reson_socket.close()
         
@@ -388,47 +395,75 @@ class com7P:
         self.newdata = False
         self.new7018 = False
         self.new7038 = False
+        framer = framer7P()
         while not self.stopTCPdata:
-            packet = self.s.recv(self.buf)
-            packetsize = len(packet)
-            if packetsize > 48:
-                headersize = struct.unpack('I', packet[12:16])[0]
-                datasize = struct.unpack('I', packet[44:48])[0] + 36
-                if datasize == headersize and datasize == packetsize:
-                    dtype = struct.unpack('I', packet[68:72])[0]
-                    if dtype == 7000:
-                        self.dataout = datain
-                        self.newdata = True
-                        datain = {}
-                        datain[str(dtype)] = packet[36:]
-                    elif dtype == 7018:
-                        self.data7018 = packet[36:]
-                        self.new7018 = True
-                    elif dtype == 7038:
-                        self.data7038 = packet[36:]
-                        self.new7038 = True
-                    elif dtype == 7501:
-                        pass
-                    elif dtype == 7502:
-                        rectype = struct.unpack(self.drf_fmt,packet[36:36+64])[12]
-                        print 'Record',
-                        print str(rectype),
-                        if rectype == 7500:
-                            mesgtype = struct.unpack('<I', data[100:104])[0]
-                            errortype = struct.unpack('<I', data[120:124])[0]
-                            print 'of message type ' + str(mesgtype),
-                            print 'had an error of type ' + str(errortype) + ' and',
-                        print 'was not sent successfully'
-                    else:
-                        datain[str(dtype)] = packet[36:]
-                    print dtype
+            if framer.recv(self.s) == 0:
+                break
+            for record in framer.records():
+                dtype = struct.unpack_from('<I', record, 32)[0]
+                if dtype == 7000:
+                    self.dataout = datain
+                    self.newdata = True
+                    datain = {}
+                    datain[str(dtype)] = record.tobytes()
+                elif dtype == 7018:
+                    self.data7018 = record.tobytes()
+                    self.new7018 = True
+                elif dtype == 7038:
+                    self.data7038 = record.tobytes()
+                    self.new7038 = True
+                elif dtype == 7501:
+                    pass
+                elif dtype == 7502:
+                    rectype = struct.unpack_from(self.drf_fmt, record, 0)[12]
+                    print 'Record',
+                    print str(rectype),
+                    if rectype == 7500:
+                        mesgtype = struct.unpack_from('<I', record, 64)[0]
+                        errortype = struct.unpack_from('<I', record, 84)[0]
+                        print 'of message type ' + str(mesgtype),
+                        print 'had an error of type ' + str(errortype) + ' and',
+                    print 'was not sent successfully'
+                else:
+                    datain[str(dtype)] = record.tobytes()
+                print dtype
             
+    def startreceiver(self, types, port = None, maxsize = 64, capture = None):
+        """Starts a receiver7P that queues the records of the given types.
+        With no port the records come over the TCP connection to the 7P,
+        which is opened if needed, otherwise from UDP on that port.  Every
+        record received, of any type, is also written to the capturewriter
+        capture if one is given.  Returns the receiver; records are taken
+        with receiver.get(recordtype)."""
+        if self.receiver is None:
+            self.receiver = receiver7P(types, maxsize)
+        else:
+            self.receiver.subscribe(types, maxsize)
+        if capture is not None:
+            self.receiver.capture = capture
+        if port is None:
+            if not self.__dict__.has_key('s'):
+                self.openTCP()
+            self.receiver.addTCP(self.s)
+        else:
+            self.receiver.addUDP(port, self.ownip)
+        self.receiver.start()
+        return self.receiver
+        
+    def stopreceiver(self):
+        """Stops the receiver started by startreceiver."""
+        if self.receiver is not None:
+            self.receiver.stop()
+            self.receiver = None
+        
     def sendTCP(self, packet, databack = False):
         """Open TCP connection with Reson 7P for this object."""
         if not self.__dict__.has_key('s'):
             self.openTCP()
         port = self.s.getsockname()[1]
-        threading.Thread(target = self._catchTCP, args = (port,)).start()
+        if self.receiver is None:
+            # without a receiver the replies are read by a catching thread
+            threading.Thread(target = self._catchTCP, args = (port,)).start()
         self.s.send(packet)
         if not databack:
             self.stopTCPdata
@@ -453,11 +488,451 @@ class com7P:
         self.stopTCPdata = True
 
     def closeTCP(self):
+        self.stopreceiver()
         self.stopTCPdata = True
         self.s.shutdown(socket.SHUT_RDWR)
         self.s.close()
         del self.s
         
+class receiver7P:
+    """Receives 7P data from any number of UDP and TCP sockets in a single
+    thread and hands each whole data record, frame header and footer
+    included, to a queue for its record type.  Records of types that are
+    not subscribed are counted in 'unwanted' and discarded.  Each queue
+    holds at most maxsize records.  While a queue is full TCP sockets are
+    not read, so the sender is slowed by TCP flow control rather than
+    records being lost.  Records from UDP for a full queue are counted in
+    'dropped' and discarded.  Transmissions that never complete are counted
+    by the reassembler.  Every subscribed queue should be drained by a
+    consumer, except those subscribed with latest, which are for types
+    read only now and then.  These keep the newest maxsize records, the
+    oldest being dropped and counted for room, and never stop the sockets
+    being read.  Records from UDP are buffers of the datagram received into
+    a bufferpool, which can be sliced like the strings from TCP or read
+    with np.frombuffer without a copy."""
+    def __init__(self, types, maxsize = 64):
+        self.queues = {}
+        # the types whose queues keep only the newest records
+        self.latest = set()
+        self.subscribe(types, maxsize)
+        # None for a UDP socket or the framer7P of a TCP socket
+        self.sockets = {}
+        self.reassembler = reassembler7P()
+        self.pool = bufferpool()
+        # a capturewriter given every record received
+        self.capture = None
+        self.received = 0
+        self.dropped = 0
+        self.unwanted = 0
+        self.timeout = 0.5
+        self.running = False
+        self.thread = None
+        
+    def subscribe(self, types, maxsize = 64, latest = False):
+        """Adds a queue for each record type in types.  With latest the
+        queue keeps only the newest maxsize records."""
+        for recordtype in types:
+            if int(recordtype) not in self.queues:
+                self.queues[int(recordtype)] = Queue.Queue(maxsize)
+                if latest:
+                    self.latest.add(int(recordtype))
+                
+    def addUDP(self, port, host = ''):
+        """Receives the UDP datagrams sent to host and port.  Returns the
+        port, useful if port 0 was given."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+        self.sockets[sock] = None
+        return sock.getsockname()[1]
+        
+    def addTCP(self, sock):
+        """Receives the data from a connected TCP socket."""
+        self.sockets[sock] = framer7P()
+        
+    def start(self):
+        """Starts the receiving thread if it is not running."""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target = self.run)
+            self.thread.daemon = True
+            self.thread.start()
+            
+    def stop(self):
+        """Stops the receiving thread and closes the UDP sockets."""
+        self.running = False
+        if self.thread is not None and self.thread is not threading.currentThread():
+            self.thread.join()
+        for sock in self.sockets.keys():
+            if self.sockets[sock] is None:
+                sock.close()
+            del self.sockets[sock]
+            
+    def get(self, recordtype, timeout = None):
+        """Returns the next record of recordtype, waiting up to timeout
+        seconds (forever if None).  Raises Queue.Empty if none comes."""
+        return self.queues[int(recordtype)].get(True, timeout)
+        
+    def run(self):
+        """Waits for data on all of the sockets and reads it."""
+        while self.running:
+            socks = self.sockets.keys()
+            if len(socks) == 0:
+                time.sleep(self.timeout)
+                continue
+            try:
+                readable = select.select(socks, [], [], self.timeout)[0]
+            except (select.error, socket.error):
+                break
+            self.reassembler.expire()
+            for sock in readable:
+                if self.sockets.get(sock, 0) is None:
+                    self.readUDP(sock)
+                elif sock in self.sockets:
+                    self.readTCP(sock)
+                    
+    def readUDP(self, sock):
+        """Reads one datagram, which holds one or more network frames."""
+        packet = self.pool.get()
+        count, address = sock.recvfrom_into(packet)
+        for header, data in splitframes(packet, count):
+            if header[2] > 1:
+                data = str(data)  # kept until the transmission is complete
+            self.frame(header, data, address, False)
+            
+    def readTCP(self, sock):
+        """Reads the available bytes of a TCP stream and passes on each
+        complete network frame."""
+        framer = self.sockets[sock]
+        if framer.recv(sock) == 0:
+            del self.sockets[sock]  # the connection was closed
+            return
+        for header, data in framer.frames():
+            # the frame is copied once here, as the framer reuses its buffer
+            self.frame(header, data.tobytes(), sock, True)
+        
+    def frame(self, header, data, source, block):
+        """Puts fragmented transmissions back together and delivers each
+        record in a complete transmission."""
+        data = self.reassembler.add(header, data, source)
+        if data is not None:
+            for record in splitrecords(data):
+                self.deliver(record, block)
+            
+    def deliver(self, record, block):
+        """Puts a record on the queue for its type, waiting for room if
+        block is True."""
+        self.received += 1
+        if self.capture is not None:
+            self.capture.write(record)
+        recordtype = struct.unpack_from('<I', record, 32)[0]
+        queue = self.queues.get(recordtype)
+        if queue is None:
+            self.unwanted += 1
+        elif recordtype in self.latest:
+            while True:
+                try:
+                    queue.put_nowait(record)
+                    return
+                except Queue.Full:
+                    try:
+                        queue.get_nowait()  # make room by dropping the oldest
+                        self.dropped += 1
+                    except Queue.Empty:
+                        pass
+        elif block:
+            while self.running:
+                try:
+                    queue.put(record, True, self.timeout)
+                    return
+                except Queue.Full:
+                    continue
+        else:
+            try:
+                queue.put_nowait(record)
+            except Queue.Full:
+                self.dropped += 1
+        
+class framer7P:
+    """Splits the TCP byte stream from the 7P into network frames.  Bytes
+    are received straight into a preallocated buffer with recv_into and
+    the frames are handed out as memoryviews of it, so nothing is copied
+    on the way.  When the end of the buffer is reached the unfinished
+    frame at the tail is moved to the front, and if a frame is larger than
+    the whole buffer a buffer twice the size is started.  A frame is only
+    good until the next call of recv; keep a copy with tobytes.  Bytes
+    that do not start a plausible frame are skipped and counted in
+    'skipped'."""
+    nf_fmt = '<2HI2H4I2HI'
+    nf_sz = 36
+    def __init__(self, size = 1048576):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.skipped = 0
+        
+    def recv(self, sock):
+        """Reads what is waiting on the socket into the buffer.  Returns the
+        number of bytes read, which is 0 once the connection is closed."""
+        if self.end == len(self.buf):
+            self.makeroom()
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        return count
+        
+    def makeroom(self):
+        """Moves the unfinished frame to the front of the buffer, or to the
+        front of a larger buffer if it already fills this one."""
+        tail = self.view[self.start:self.end].tobytes()
+        if self.start == 0:
+            # frames handed out of the old buffer stay valid this way
+            self.buf = bytearray(2 * len(self.buf))
+            self.view = memoryview(self.buf)
+        self.view[:len(tail)] = tail
+        self.start = 0
+        self.end = len(tail)
+        
+    def frames(self):
+        """A generator of the network frame header and a memoryview of the
+        data of each complete frame in the buffer."""
+        while self.end - self.start >= self.nf_sz:
+            header = struct.unpack_from(self.nf_fmt, self.buf, self.start)
+            if (header[1] < self.nf_sz or header[5] < header[1] or header[2] < 1
+                or header[7] >= header[2] or header[5] - header[1] > header[6]):
+                self.start += 1
+                self.skipped += 1
+                continue
+            if header[7] == 0 and header[5] - header[1] >= 8:
+                # the first frame of a transmission starts with a record frame
+                if self.end - self.start < header[1] + 8:
+                    break
+                if struct.unpack_from('<I', self.buf, self.start + header[1] + 4)[0] != 0xFFFF:
+                    self.start += 1
+                    self.skipped += 1
+                    continue
+            if self.end - self.start < header[5]:
+                break
+            pos = self.start
+            self.start += header[5]
+            yield header, self.view[pos + header[1]:pos + header[5]]
+        if self.start == self.end:
+            self.start = self.end = 0
+            
+    def records(self):
+        """A generator of a memoryview of each data record sent whole in
+        one network frame, as the 7P does over TCP."""
+        for header, data in self.frames():
+            if header[2] == 1:
+                for record in splitrecords(data):
+                    yield record
+                    
+class capturewriter:
+    """Writes the records received from the 7P to s7k files.  Records are
+    queued by write, which never waits, and written by a thread of its own
+    through a large file buffer, so delays from the disk do not hold up
+    receiving and no record is dropped; the queue grows instead.  A new
+    file is started when the next record would take the file past maxsize
+    bytes or the file has been open maxtime seconds, where these are not
+    0.  The first file has the name given and the later ones a number
+    added, filename_001.s7k and so on, listed in 'files'.  The data is
+    flushed and synced to the disk every syncinterval seconds."""
+    def __init__(self, filename, maxsize = 0, maxtime = 0, syncinterval = 5., bufsize = 4194304):
+        self.filename = filename
+        self.root, self.ext = os.path.splitext(filename)
+        self.maxsize = maxsize
+        self.maxtime = maxtime
+        self.syncinterval = syncinterval
+        self.bufsize = bufsize
+        self.queue = Queue.Queue()
+        self.files = []
+        self.records = 0
+        self.bytes = 0
+        self.outfile = None
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        
+    def write(self, record):
+        """Queues a record, a string or buffer, to be written."""
+        self.queue.put(record)
+        
+    def close(self):
+        """Writes the records still queued and closes the file."""
+        self.queue.put(None)
+        self.thread.join()
+        
+    def newfile(self):
+        """Closes the current file and opens the next."""
+        self.closefile()
+        if len(self.files) == 0:
+            name = self.filename
+        else:
+            name = '%s_%03d%s' % (self.root, len(self.files), self.ext)
+        self.outfile = open(name, 'wb', self.bufsize)
+        self.files.append(name)
+        self.opened = time.time()
+        self.synced = self.opened
+        self.filesize = 0
+        
+    def closefile(self):
+        if self.outfile is not None:
+            self.sync()
+            self.outfile.close()
+            self.outfile = None
+            
+    def sync(self):
+        """Flushes the file buffer and syncs the file to the disk."""
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+        self.synced = time.time()
+        
+    def run(self):
+        """Writes the queued records until close is called."""
+        self.newfile()
+        while True:
+            try:
+                record = self.queue.get(True, 1.)
+            except Queue.Empty:
+                record = ''
+            if record is None:
+                break
+            if len(record) > 0:
+                if self.filesize > 0 and ((self.maxsize > 0 and self.filesize + len(record) > self.maxsize)
+                    or (self.maxtime > 0 and time.time() - self.opened > self.maxtime)):
+                    self.newfile()
+                self.outfile.write(record)
+                self.filesize += len(record)
+                self.bytes += len(record)
+                self.records += 1
+            if self.syncinterval > 0 and time.time() - self.synced > self.syncinterval:
+                self.sync()
+        self.closefile()
+        
+class bufferpool:
+    """A pool of preallocated bytearrays to receive datagrams into with
+    recvfrom_into, rather than making a new string for each one.  Records
+    are handed on as buffers of the bytearrays, which np.frombuffer and the
+    prr decoders read without a copy.  A bytearray is used again once
+    nothing refers to it, so records and arrays made from them can be kept
+    as long as needed; the pool grows if they are all held, which is
+    counted in 'allocated'."""
+    def __init__(self, count = 64, size = 65536):
+        self.size = size
+        self.buffers = [bytearray(size) for n in xrange(count)]
+        self.allocated = count
+        self.next = 0
+        
+    def get(self):
+        """Returns a bytearray from the pool that is not in use."""
+        total = len(self.buffers)
+        for n in xrange(total):
+            index = (self.next + n) % total
+            # held only by the list and the argument of getrefcount
+            if sys.getrefcount(self.buffers[index]) == 2:
+                self.next = index + 1
+                return self.buffers[index]
+        buf = bytearray(self.size)
+        self.buffers.append(buf)
+        self.allocated += 1
+        return buf
+        
+class reassembler7P:
+    """Puts records sent as more than one network frame back together.  The
+    frames are kept by source and transmission identifier until every
+    sequence number has arrived, in any order.  A transmission that is not
+    complete within timeout seconds of its first frame, or is the oldest
+    when more than maxpending are waiting, is dropped and counted in
+    'lost', with its missing frames counted in 'lostframes'.  Frames that
+    arrive twice are counted in 'duplicates' and whole transmissions in
+    'complete'."""
+    def __init__(self, timeout = 2., maxpending = 256):
+        self.timeout = timeout
+        self.maxpending = maxpending
+        # (first arrival time, total packets, frame data by sequence number)
+        self.pending = {}
+        self.order = []
+        self.complete = 0
+        self.lost = 0
+        self.lostframes = 0
+        self.duplicates = 0
+        
+    def add(self, header, data, source = None):
+        """Adds the header and data of a network frame, which is kept, so it
+        must not be a view of a reused buffer.  Returns the data of the
+        whole transmission once it is complete, otherwise None."""
+        totalpackets, transid, seqnum = header[2], header[4], header[7]
+        if totalpackets == 1:
+            self.complete += 1
+            return data
+        if seqnum >= totalpackets:
+            return None
+        key = (source, transid)
+        if key not in self.pending:
+            self.pending[key] = (time.time(), totalpackets, {})
+            self.order.append(key)
+            if len(self.order) > self.maxpending:
+                self.drop(self.order[0])
+        parts = self.pending[key][2]
+        if seqnum in parts:
+            self.duplicates += 1
+            return None
+        parts[seqnum] = data
+        if len(parts) < totalpackets:
+            return None
+        del self.pending[key]
+        self.order.remove(key)
+        self.complete += 1
+        return ''.join([parts[n] for n in xrange(totalpackets)])
+        
+    def drop(self, key):
+        """Drops an incomplete transmission."""
+        totalpackets, parts = self.pending.pop(key)[1:]
+        self.order.remove(key)
+        self.lost += 1
+        self.lostframes += totalpackets - len(parts)
+        
+    def expire(self, now = None):
+        """Drops the transmissions that have waited longer than timeout and
+        returns how many were dropped."""
+        if now is None:
+            now = time.time()
+        count = 0
+        while len(self.order) > 0 and now - self.pending[self.order[0]][0] > self.timeout:
+            self.drop(self.order[0])
+            count += 1
+        return count
+        
+def splitframes(packet, count = None):
+    """A generator of the network frame header and data of each frame in
+    the first count bytes of a UDP datagram from the 7P.  The data are
+    buffers of packet."""
+    nf_fmt = '<2HI2H4I2HI'
+    if count is None:
+        count = len(packet)
+    pos = 0
+    while pos + 36 <= count:
+        header = struct.unpack_from(nf_fmt, packet, pos)
+        if header[1] < 36 or header[5] < header[1] or pos + header[5] > count:
+            break
+        yield header, buffer(packet, pos + header[1], header[5] - header[1])
+        pos += header[5]
+        
+def splitrecords(data):
+    """A generator of each data record in the data of a transmission, which
+    can hold more than one.  The records are slices of data, or buffers of
+    it if it is a buffer, as slices of a buffer are copies."""
+    isbuffer = isinstance(data, buffer)
+    pos = 0
+    while pos + 68 <= len(data):
+        size = struct.unpack_from('<I', data, pos + 8)[0]
+        if size < 68 or pos + size > len(data):
+            break
+        if isbuffer:
+            yield buffer(data, pos, size)
+        else:
+            yield data[pos:pos + size]
+        pos += size
+        
 def main():
     print """\nReson 7125 Calibration V-0.1 (for experimental use)\n"""
     